@@ -1,104 +1,279 @@
-import mailbox
+import mmap
 import os
-import sys
 import email.utils
-from datetime import datetime, timezone
-import hashlib
-import random
+import functools
+import json
 import time
 import re
 import sqlite3
+from concurrent.futures import ProcessPoolExecutor
 
 # We reuse the helper functions from our main script to ensure consistent logic
 # Ensure your main script is named 'process_to_text.py'
-from process_to_text import parse_date, get_email_body
+from process_to_text import get_email_body, mapped_file, iter_mbox_spans, parse_headers, THREAD_DATE_INDEX_SQL
+from hash_cache import bytes_digest, hashed
+from export_attachments_by_year import MANIFEST_FILENAME
 
 # --- Configuration ---
 MBOX_FILE_PATH = 'All mail Including Spam and Trash.mbox'
 DB_FILE = 'email_index.db'
+MBOX_INDEX_FILE = 'mbox_offsets.db'
 SAMPLE_PERCENTAGE = 0.01  # 1%
 
-def get_db_data_and_thread_years(db_file):
+# Matches the start of each message block written by process_to_text.format_message
+TEXT_BLOCK_RE = re.compile(rb'^--- MESSAGE ---\nMessage-ID: (.*?)\nThread-ID: ', re.MULTILINE | re.DOTALL)
+
+def get_db_sample_and_thread_years(db_file, sample_percentage):
     """
-    Fetches all data from the database and calculates the correct "thread year" for each thread.
-    Returns two dictionaries: one with all message data, and one mapping thread_id to its final year.
+    Draws a random sample of messages from the database and calculates the correct
+    "thread year" for each. Returns the total message count and a list of
+    (message_id, thread_year) tuples.
     """
-    print(f"-> Loading data and calculating thread years from '{db_file}'...")
+    print(f"-> Sampling messages and calculating thread years from '{db_file}'...")
     if not os.path.exists(db_file): return None, None
 
     conn = sqlite3.connect(db_file)
+    # Sampling is a one-shot full table scan: map the file, use a big page cache, keep temp data in RAM
+    conn.execute('PRAGMA mmap_size=268435456')
+    conn.execute('PRAGMA cache_size=-65536')
+    conn.execute('PRAGMA temp_store=MEMORY')
     cur = conn.cursor()
+    cur.arraysize = 10_000
+
+    # A (thread_id, date_unix) index lets the per-thread MAX below run off the index alone
+    cur.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_emails_thread_date'")
+    if not cur.fetchone():
+        print("   ...creating thread/date index (first run only)...")
+        cur.execute(THREAD_DATE_INDEX_SQL)
+        cur.execute("ANALYZE emails")
+        conn.commit()
+
+    cur.execute("SELECT COUNT(*) FROM emails")
+    total_message_count = cur.fetchone()[0]
+    sample_size = max(1, int(total_message_count * sample_percentage))
     
-    cur.execute("SELECT thread_id, MAX(date_unix) FROM emails GROUP BY thread_id")
-    thread_latest_date = {row[0]: row[1] for row in cur.fetchall()}
-    thread_year_map = {
-        thread_id: datetime.fromtimestamp(ts, timezone.utc).year
-        for thread_id, ts in thread_latest_date.items()
-    }
-    
-    cur.execute("SELECT message_id, thread_id, from_str, to_str, cc_str, subject_str, gmail_labels, body FROM emails")
-    db_messages = {
-        row[0]: { 'thread_id': row[1], 'From': row[2], 'To': row[3], 'Cc': row[4],
-                  'Subject': row[5], 'Labels': row[6], 'body': row[7] }
-        for row in cur.fetchall()
-    }
+    # Sample in SQL so only the chosen (message_id, thread_id) pairs ever reach Python,
+    # then look up each sampled thread's latest date through the index. SQLite turns it
+    # into the (UTC) year, so Python does no date math per row.
+    cur.execute("""
+        SELECT s.message_id,
+               CAST(strftime('%Y', (SELECT MAX(e.date_unix) FROM emails e WHERE e.thread_id = s.thread_id),
+                             'unixepoch') AS INTEGER)
+        FROM (SELECT message_id, thread_id FROM emails ORDER BY RANDOM() LIMIT ?) s
+    """, (sample_size,))
+    sample = cur.fetchall()
     conn.close()
     
-    print(f"   ...loaded {len(db_messages)} records.")
-    return db_messages, thread_year_map
+    print(f"   ...sampled {len(sample)} of {total_message_count} records.")
+    return total_message_count, sample
+
+def build_mbox_offset_index(mbox_path):
+    """
+    Scans the Mbox once and maps each Message-ID to the (offset, length) of its raw bytes.
+    Only the header block of each message is parsed, so no message trees are kept in memory.
+    """
+    index = {}
+    with mapped_file(mbox_path) as mm:
+        for start, end in iter_mbox_spans(mm):
+            msg_id = parse_headers(mm, start, end).get('Message-ID')
+            if msg_id:
+                index[msg_id] = (start, end - start)
+    return index
+
+def load_mbox_offset_index(mbox_path, index_file=MBOX_INDEX_FILE):
+    """
+    Returns the Mbox offset index, reusing the copy persisted in `index_file`
+    when the Mbox size and mtime are unchanged since it was built.
+    """
+    st = os.stat(mbox_path)
+    conn = sqlite3.connect(index_file)
+    cur = conn.cursor()
+    cur.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+    cur.execute("CREATE TABLE IF NOT EXISTS mbox_offsets (message_id TEXT PRIMARY KEY, offset INTEGER, length INTEGER)")
 
-def run_single_audit(msg_id, db_record, thread_year_map, mbox_dict):
+    cur.execute("SELECT value FROM meta WHERE key = 'mbox_stat'")
+    row = cur.fetchone()
+    mbox_stat = f"{os.path.abspath(mbox_path)}:{st.st_size}:{st.st_mtime_ns}"
+    if row and row[0] == mbox_stat:
+        cur.execute("SELECT message_id, offset, length FROM mbox_offsets")
+        index = {msg_id: (offset, length) for msg_id, offset, length in cur}
+    else:
+        print("   ...no usable offset index found, scanning Mbox file...")
+        index = build_mbox_offset_index(mbox_path)
+        with conn:
+            cur.execute("DELETE FROM mbox_offsets")
+            cur.executemany(
+                "INSERT INTO mbox_offsets (message_id, offset, length) VALUES (?, ?, ?)",
+                ((msg_id, offset, length) for msg_id, (offset, length) in index.items())
+            )
+            cur.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('mbox_stat', ?)", (mbox_stat,))
+    conn.close()
+    return index
+
+def read_mbox_message(mbox_file, offset, length):
+    """Reads and fully parses a single message from an open (binary) Mbox file."""
+    mbox_file.seek(offset)
+    return email.message_from_bytes(mbox_file.read(length))
+
+def text_file_path(year):
+    return os.path.join('yearly_text_archives', f'{year}.txt')
+
+@functools.lru_cache(maxsize=None)
+def _mmap_year(year):
+    """
+    Maps a yearly text file into memory once and keeps it open for every later
+    audit of that year. Returns None if the file does not exist.
+    """
+    try:
+        with open(text_file_path(year), 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return b''
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except FileNotFoundError:
+        return None
+
+@functools.lru_cache(maxsize=None)
+def build_text_index(year):
+    """
+    Scans a yearly text file once and maps each Message-ID to the (start, end)
+    byte range of its message block. Returns None if the file does not exist.
+    """
+    mm = _mmap_year(year)
+    if mm is None:
+        return None
+    matches = list(TEXT_BLOCK_RE.finditer(mm))
+    ends = [m.start() for m in matches[1:]] + [len(mm)]
+    return {
+        m.group(1).decode('utf-8'): (m.start(), end)
+        for m, end in zip(matches, ends)
+    }
+
+@functools.lru_cache(maxsize=None)
+def _load_manifest(year):
+    """
+    Loads the extraction manifest of a year directory as
+    {(msgid, original filename): [entries in extraction order]}.
+    """
+    manifest = {}
+    try:
+        with open(os.path.join('attachments_by_year', str(year), MANIFEST_FILENAME), encoding='utf-8') as f:
+            for line in f:
+                entry = json.loads(line)
+                manifest.setdefault((entry['msgid'], entry['original']), []).append(entry)
+    except FileNotFoundError:
+        pass
+    return manifest
+
+DUPLICATE_SUFFIX_RE = re.compile(r'^(.*)_(\d+)$')
+
+@functools.lru_cache(maxsize=None)
+def _year_files(year):
+    """Lists a year's attachment directory once, so presence checks need no stat calls."""
+    try:
+        return frozenset(os.listdir(os.path.join('attachments_by_year', str(year))))
+    except FileNotFoundError:
+        return frozenset()
+
+@functools.lru_cache(maxsize=None)
+def _year_listing(year):
+    """
+    Groups a year's attachment files as {(name, ext): [filenames]}, where each list
+    holds "name.ext" followed by its "name_N.ext" duplicates in suffix order.
+    """
+    listing = {}
+    for fname in _year_files(year):
+        name, ext = os.path.splitext(fname)
+        listing.setdefault((name, ext), []).append((0, fname))
+        match = DUPLICATE_SUFFIX_RE.match(name)
+        if match:
+            listing.setdefault((match.group(1), ext), []).append((int(match.group(2)), fname))
+    return {key: [fname for _, fname in sorted(names)] for key, names in listing.items()}
+
+# Per-process handle to the Mbox, opened by the pool initializer
+_worker_mbox_file = None
+
+def _init_audit_worker(mbox_path):
+    """Opens the Mbox file once per worker process."""
+    global _worker_mbox_file
+    _worker_mbox_file = open(mbox_path, 'rb')
+
+def audit_one(task):
+    """Process pool entry point: audits one (msg_id, year, mbox_location) task."""
+    msg_id = task[0]
+    return msg_id, *run_single_audit(*task, _worker_mbox_file)
+
+def run_single_audit(msg_id, correct_year, mbox_location, mbox_file):
     """Performs an end-to-end audit for a single message and returns (bool, reason)."""
     
     # === Part 1: Find the correct year and original Mbox message ===
-    thread_id = db_record['thread_id']
-    correct_year = thread_year_map.get(thread_id)
     if not correct_year:
         return False, "Could not determine correct thread year from database."
 
-    original_message = mbox_dict.get(msg_id)
-    if not original_message:
+    if not mbox_location:
         return False, "Message-ID found in DB, but not found during Mbox pre-scan."
+    original_message = read_mbox_message(mbox_file, *mbox_location)
 
     # === Part 2: Verify Text Content ===
-    text_file_path = os.path.join('yearly_text_archives', f'{correct_year}.txt')
-    try:
-        with open(text_file_path, 'r', encoding='utf-8') as f:
-            full_text_content = f.read()
-    except FileNotFoundError:
-        return False, f"Text file not found: {text_file_path}"
+    text_path = text_file_path(correct_year)
+    text_index = build_text_index(correct_year)
+    if text_index is None:
+        return False, f"Text file not found: {text_path}"
         
-    if msg_id not in full_text_content:
-        return False, f"Message-ID not found in text file '{text_file_path}'."
+    # Archive header lines are LF-only, including a folded CRLF Message-ID
+    text_key = msg_id.replace('\r\n', '\n')
+    if text_key not in text_index:
+        return False, f"Message-ID not found in text file '{text_path}'."
+
+    # Only the message's own block is read back, not the whole text file
+    start, end = text_index[text_key]
+    text_block = _mmap_year(correct_year)[start:end]
     
-    # A simple check to see if the body text (normalized) is present
-    original_text_body = get_email_body(original_message).strip().replace('\r\n', '\n')
-    if original_text_body and original_text_body not in full_text_content.replace('\r\n', '\n'):
+    # A simple check to see if the body text (normalized) is present. The text files
+    # are LF-only, so the block is searched as raw bytes; files written by older
+    # versions may still contain CRLF and are normalized on a miss.
+    original_text_body = get_email_body(original_message).strip().replace('\r\n', '\n').encode('utf-8')
+    if original_text_body and original_text_body not in text_block \
+            and original_text_body not in text_block.replace(b'\r\n', b'\n'):
          return False, "Plain text body mismatch between Mbox and text file."
 
     # === Part 3: Verify Attachments ===
+    # Like extract_attachments, only multipart messages can carry attachments
+    if not original_message.is_multipart():
+        return True, "OK"
+
+    manifest = _load_manifest(correct_year)
+    occurrences = {}
     for part in original_message.walk():
-        if "attachment" in str(part.get('Content-Disposition')):
+        if part.get_content_disposition() == 'attachment':
             filename = part.get_filename()
             if filename:
-                attachment_path = os.path.join('attachments_by_year', str(correct_year), filename)
-                
-                if not os.path.exists(attachment_path):
-                    # Handle cases where duplicate filenames were renamed (e.g., file_1.pdf)
-                    # This is a simplified check for the first duplicate.
-                    name, ext = os.path.splitext(filename)
-                    dup_path = os.path.join('attachments_by_year', str(correct_year), f"{name}_1{ext}")
-                    if not os.path.exists(dup_path):
+                # Prefer the checksum recorded at extraction time, which avoids decoding the payload
+                nth = occurrences[filename] = occurrences.get(filename, -1) + 1
+                entries = manifest.get((msg_id, filename), ())
+                if nth < len(entries):
+                    if entries[nth]['filename'] not in _year_files(correct_year):
                         return False, f"Attachment not found: {filename}"
-                    else:
-                        attachment_path = dup_path
+                    attachment_path = os.path.join('attachments_by_year', str(correct_year), entries[nth]['filename'])
+                    try:
+                        if hashed(attachment_path) != entries[nth]['sha256']:
+                            return False, f"Checksum mismatch for attachment: {filename}"
+                    except Exception as e:
+                        return False, f"Error checking attachment {filename}: {e}"
+                    continue
+
+                # No manifest entry (e.g. extracted by an older version), compare against the Mbox payload.
+                # Duplicate filenames were renamed on extraction (e.g. file_1.pdf), so any variant may hold it.
+                name, ext = os.path.splitext(filename)
+                candidates = _year_listing(correct_year).get((name, ext))
+                if not candidates:
+                    return False, f"Attachment not found: {filename}"
 
                 try:
                     original_payload = part.get_payload(decode=True)
-                    with open(attachment_path, 'rb') as f_extracted:
-                        extracted_payload = f_extracted.read()
+                    original_checksum = bytes_digest(original_payload)
                     
-                    if hashlib.sha256(original_payload).hexdigest() != hashlib.sha256(extracted_payload).hexdigest():
+                    year_dir = os.path.join('attachments_by_year', str(correct_year))
+                    if not any(hashed(os.path.join(year_dir, cand)) == original_checksum for cand in candidates):
                         return False, f"Checksum mismatch for attachment: {filename}"
                 except Exception as e:
                     return False, f"Error checking attachment {filename}: {e}"
@@ -106,40 +281,43 @@ def run_single_audit(msg_id, db_record, thread_year_map, mbox_dict):
     return True, "OK"
 
 def main():
-    db_data, thread_years = get_db_data_and_thread_years(DB_FILE)
-    if db_data is None: return
+    total_message_count, sample = get_db_sample_and_thread_years(DB_FILE, SAMPLE_PERCENTAGE)
+    if sample is None: return
 
-    print(f"-> Pre-loading Mbox file into memory for fast lookups...")
+    print(f"-> Loading Mbox offset index for fast lookups...")
     start_time = time.time()
-    mbox_dict = {msg.get('Message-ID'): msg for msg in mailbox.mbox(MBOX_FILE_PATH) if msg.get('Message-ID')}
+    mbox_index = load_mbox_offset_index(MBOX_FILE_PATH)
     duration = time.time() - start_time
-    print(f"   ...loaded {len(mbox_dict)} messages in {duration:.2f} seconds.")
+    print(f"   ...indexed {len(mbox_index)} messages in {duration:.2f} seconds.")
 
-    total_message_count = len(db_data)
-    sample_size = max(1, int(total_message_count * SAMPLE_PERCENTAGE))
-    
-    ids_to_audit = random.sample(list(db_data.keys()), sample_size)
+    sample_size = len(sample)
+    # Audit year by year (and in Mbox order within a year) so consecutive audits
+    # hit the same, already mapped text file and nearby parts of the Mbox
+    sample.sort(key=lambda item: (
+        item[1] or 0,
+        mbox_index.get(item[0], (0, 0))[0],
+    ))
     
     print(f"\n--- Auditing {sample_size} random messages... ---")
     passed_count, failed_count = 0, 0
 
-    for i, msg_id in enumerate(ids_to_audit):
-        db_record = db_data.get(msg_id)
-        if not db_record: continue
-            
-        is_ok, reason = run_single_audit(msg_id, db_record, thread_years, mbox_dict)
-        
-        if is_ok:
-            passed_count += 1
-            print('.', end='', flush=True)
-        else:
-            failed_count += 1
-            # This is the new verbose failure output
-            print(f"\nF -> FAILURE on {msg_id}:\n   {reason}")
+    # Each audit is independent and mostly CPU-bound (MIME parsing, base64, sha256),
+    # so they are spread across processes; results are rendered here in order.
+    tasks = [(msg_id, year, mbox_index.get(msg_id)) for msg_id, year in sample]
+    with ProcessPoolExecutor(max_workers=os.cpu_count(), initializer=_init_audit_worker,
+                             initargs=(MBOX_FILE_PATH,)) as executor:
+        for msg_id, is_ok, reason in executor.map(audit_one, tasks, chunksize=16):
+            if is_ok:
+                passed_count += 1
+                print('.', end='', flush=True)
+            else:
+                failed_count += 1
+                # This is the new verbose failure output
+                print(f"\nF -> FAILURE on {msg_id}:\n   {reason}")
 
     print("\n\n--- Final Audit Complete ---")
-    print(f"Result on {sample_size} message sample: {passed} PASSED, {failed_count} FAILED.")
-    if failed == 0:
+    print(f"Result on {sample_size} message sample: {passed_count} PASSED, {failed_count} FAILED.")
+    if failed_count == 0:
         print("✅ Archive integrity confirmed with high confidence.")
     else:
         print("❌ Issues detected. See failure reasons above.")
@@ -1,51 +1,79 @@
+import json
 import os
-import hashlib
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
-def get_file_hash(file_path):
-    """Calculates the SHA256 hash of a file."""
-    hasher = hashlib.sha256()
-    with open(file_path, 'rb') as f:
-        buf = f.read()
-        hasher.update(buf)
-    return hasher.hexdigest()
+from hash_cache import hashed
+from export_attachments_by_year import MANIFEST_FILENAME
+
+HASH_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+
+def repoint_manifest(year_dir, replaced):
+    """Points manifest entries for deleted duplicates at the copy that was kept."""
+    manifest_path = os.path.join(year_dir, MANIFEST_FILENAME)
+    if not os.path.exists(manifest_path):
+        return
+    with open(manifest_path, encoding='utf-8') as f:
+        entries = [json.loads(line) for line in f]
+    for entry in entries:
+        entry['filename'] = replaced.get(entry['filename'], entry['filename'])
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        f.writelines(json.dumps(entry) + "\n" for entry in entries)
 
 def clean_and_deduplicate(base_dir):
     """
     Removes .ics files and deduplicates files within each year's directory.
     """
-    for year in range(2008, 2026):
-        year_dir = os.path.join(base_dir, str(year))
-
-        if not os.path.isdir(year_dir):
-            continue
-
-        print(f"Processing directory: {year_dir}")
-
-        # First, remove all .ics files
-        for filename in os.listdir(year_dir):
-            if filename.lower().endswith('.ics'):
-                file_path = os.path.join(year_dir, filename)
-                try:
-                    os.remove(file_path)
-                    print(f"  Deleted .ics file: {filename}")
-                except OSError as e:
-                    print(f"Error deleting file {file_path}: {e}")
-
-        # Now, deduplicate the remaining files
-        hashes = {}
-        for filename in os.listdir(year_dir):
-            file_path = os.path.join(year_dir, filename)
-            if os.path.isfile(file_path):
-                file_hash = get_file_hash(file_path)
-                if file_hash in hashes:
-                    #print(f"  Found duplicate: {filename} is a duplicate of {hashes[file_hash]}")
-                    try:
-                        os.remove(file_path)
-                        print(f"  Deleted duplicate file: {filename}")
-                    except OSError as e:
-                        print(f"Error deleting file {file_path}: {e}")
-                else:
-                    hashes[file_hash] = filename
+    with ThreadPoolExecutor(max_workers=HASH_WORKERS) as executor:
+        for year in range(2008, 2026):
+            year_dir = os.path.join(base_dir, str(year))
+
+            if not os.path.isdir(year_dir):
+                continue
+
+            print(f"Processing directory: {year_dir}")
+
+            # Remove all .ics files and bucket the rest by size in a single pass.
+            # Only files that share a size with another file can be duplicates.
+            size_map = defaultdict(list)
+            with os.scandir(year_dir) as entries:
+                for entry in entries:
+                    if entry.name.lower().endswith('.ics'):
+                        try:
+                            os.remove(entry.path)
+                            print(f"  Deleted .ics file: {entry.name}")
+                        except OSError as e:
+                            print(f"Error deleting file {entry.path}: {e}")
+                    elif entry.is_file() and entry.name != MANIFEST_FILENAME:
+                        size_map[entry.stat().st_size].append(entry)
+
+            # Hash every file that shares its size with another one concurrently;
+            # hashlib releases the GIL, so threads overlap both I/O and hashing.
+            # Cached digests are reused for unchanged files; singletons are never hashed.
+            candidates = [entry.path for same_size in size_map.values() if len(same_size) > 1 for entry in same_size]
+            file_hashes = dict(zip(candidates, executor.map(hashed, candidates)))
+
+            # Removals stay serial, keeping the first file seen in each bucket
+            replaced = {}
+            for same_size in size_map.values():
+                if len(same_size) < 2:
+                    continue
+                hashes = {}
+                for entry in same_size:
+                    file_hash = file_hashes[entry.path]
+                    if file_hash in hashes:
+                        #print(f"  Found duplicate: {entry.name} is a duplicate of {hashes[file_hash]}")
+                        try:
+                            os.remove(entry.path)
+                            replaced[entry.name] = hashes[file_hash]
+                            print(f"  Deleted duplicate file: {entry.name}")
+                        except OSError as e:
+                            print(f"Error deleting file {entry.path}: {e}")
+                    else:
+                        hashes[file_hash] = entry.name
+
+            if replaced:
+                repoint_manifest(year_dir, replaced)
     print("\nProcessing complete.")
 
 if __name__ == '__main__':
@@ -1,77 +1,157 @@
-import mailbox
 import os
 import email.utils
+import json
 from datetime import datetime
 import sys
 
+from hash_cache import bytes_digest
+from process_to_text import mapped_file, iter_mbox_spans, parse_headers
+
+# Each year directory gets a manifest of what was extracted into it, one JSON object per line:
+# {"msgid": ..., "original": <attachment filename>, "filename": <saved as>, "sha256": ...}
+MANIFEST_FILENAME = 'manifest.jsonl'
+
+def load_manifest(year_dir, present):
+    """
+    Reads an existing manifest, keeping only entries for files still present. Returns
+    {sha256: filename}, so a rerun also skips content an earlier run already saved, and
+    {(msgid, original): [filenames in extraction order]}, so it doesn't record them twice.
+    """
+    hashes = {}
+    recorded = {}
+    try:
+        with open(os.path.join(year_dir, MANIFEST_FILENAME), encoding='utf-8') as f:
+            for line in f:
+                entry = json.loads(line)
+                if entry['filename'] in present:
+                    hashes.setdefault(entry['sha256'], entry['filename'])
+                    recorded.setdefault((entry['msgid'], entry['original']), []).append(entry['filename'])
+    except FileNotFoundError:
+        pass
+    return hashes, recorded
+
 def extract_attachments(mbox_file_path):
     """
     Extracts attachments from an Mbox file and organizes them into folders by year.
     """
     # Create a main directory for all attachments
     output_parent_dir = "attachments_by_year"
-    if not os.path.exists(output_parent_dir):
-        os.makedirs(output_parent_dir)
+    os.makedirs(output_parent_dir, exist_ok=True)
 
-    print(f"-> Opening Mbox file: {mbox_file_path}")
-    mbox = mailbox.mbox(mbox_file_path)
-    
     total_messages = 0
     attachments_extracted = 0
+    manifests = {}
+    duplicates_skipped = 0
+    # Filenames already present in each year directory, and {sha256: filename} of their contents
+    written = {}
+    year_hashes = {}
+    year_recorded = {}
+
+    print(f"-> Opening Mbox file: {mbox_file_path}")
+    with mapped_file(mbox_file_path) as mbox:
+        print("-> Starting extraction process...")
+        for i, (start, end) in enumerate(iter_mbox_spans(mbox)):
+            total_messages += 1
 
-    print("-> Starting extraction process...")
-    for i, message in enumerate(mbox):
-        total_messages += 1
-
-        # Get the email's date
-        date_tuple = email.utils.parsedate_tz(message.get('Date'))
-        if date_tuple:
-            # Create a datetime object to easily get the year
-            local_date = datetime.fromtimestamp(email.utils.mktime_tz(date_tuple))
-            year_str = str(local_date.year)
-        else:
-            # Fallback for messages with no valid date
-            year_str = "unknown_year"
+            # Parse just the header block first. Only multipart messages can hold
+            # attachments, so everything else never gets a full MIME parse.
+            headers = parse_headers(mbox, start, end)
+            if headers.get_content_maintype() == 'multipart':
+                message = email.message_from_bytes(mbox[start:end])
+            else:
+                message = headers
+
+            # Get the email's date
+            date_tuple = email.utils.parsedate_tz(message.get('Date'))
+            if date_tuple:
+                # Create a datetime object to easily get the year
+                local_date = datetime.fromtimestamp(email.utils.mktime_tz(date_tuple))
+                year_str = str(local_date.year)
+            else:
+                # Fallback for messages with no valid date
+                year_str = "unknown_year"
+
+            # Stored as text like process_to_text does; non-ASCII values come back as Header objects
+            msg_id = message.get('Message-ID')
+            msg_id = str(msg_id) if msg_id is not None else None
+            # How many attachments of each name this message has had so far
+            occurrences = {}
         
-        # Check each part of the message for attachments
-        if message.is_multipart():
-            for part in message.walk():
-                # Check the Content-Disposition header to see if it's an attachment
-                content_disposition = str(part.get('Content-Disposition'))
-                if "attachment" in content_disposition:
-                    # It's an attachment, get the filename
-                    filename = part.get_filename()
-                    if filename:
-                        # Create the year-specific directory
-                        year_dir = os.path.join(output_parent_dir, year_str)
-                        if not os.path.exists(year_dir):
-                            os.makedirs(year_dir)
-                        
-                        # Create the full file path
-                        filepath = os.path.join(year_dir, filename)
-                        
-                        # Handle duplicate filenames
-                        counter = 1
-                        while os.path.exists(filepath):
-                            name, ext = os.path.splitext(filename)
-                            filepath = os.path.join(year_dir, f"{name}_{counter}{ext}")
-                            counter += 1
-                        
-                        # Decode the attachment payload and save it
-                        try:
-                            with open(filepath, 'wb') as f:
-                                f.write(part.get_payload(decode=True))
-                            attachments_extracted += 1
-                            print(f"   - Saved: {filepath}")
-                        except Exception as e:
-                            print(f"   - ERROR saving {filename}: {e}")
-
-        if (i + 1) % 1000 == 0:
-            print(f"  ...scanned {i+1} messages...")
+            # Check each part of the message for attachments
+            if message.is_multipart():
+                for part in message.walk():
+                    # Check the Content-Disposition header to see if it's an attachment
+                    if part.get_content_disposition() == 'attachment':
+                        # It's an attachment, get the filename
+                        filename = part.get_filename()
+                        if filename:
+                            nth = occurrences.get(filename, 0)
+                            occurrences[filename] = nth + 1
+                            # Create the year-specific directory and snapshot its contents once
+                            year_dir = os.path.join(output_parent_dir, year_str)
+                            if year_dir not in written:
+                                os.makedirs(year_dir, exist_ok=True)
+                                written[year_dir] = set(os.listdir(year_dir))
+                                written[year_dir].add(MANIFEST_FILENAME)
+                                year_hashes[year_dir], year_recorded[year_dir] = load_manifest(year_dir, written[year_dir])
+                                manifests[year_dir] = open(os.path.join(year_dir, MANIFEST_FILENAME), 'a', encoding='utf-8')
+
+                            # Decode and hash the attachment payload once
+                            try:
+                                payload = part.get_payload(decode=True)
+                                checksum = bytes_digest(payload)
+                            except Exception as e:
+                                print(f"   - ERROR saving {filename}: {e}")
+                                continue
+
+                            saved_as = year_hashes[year_dir].get(checksum)
+                            if saved_as is not None:
+                                # Identical content is already saved for this year, don't write another copy
+                                duplicates_skipped += 1
+                            else:
+                                # Handle duplicate filenames against the in-memory snapshot
+                                candidate = filename
+                                counter = 1
+                                while candidate in written[year_dir]:
+                                    name, ext = os.path.splitext(filename)
+                                    candidate = f"{name}_{counter}{ext}"
+                                    counter += 1
+                                written[year_dir].add(candidate)
+
+                                # Create the full file path and save it
+                                filepath = os.path.join(year_dir, candidate)
+                                try:
+                                    with open(filepath, 'wb') as f:
+                                        f.write(payload)
+                                    attachments_extracted += 1
+                                    print(f"   - Saved: {filepath}")
+                                except Exception as e:
+                                    print(f"   - ERROR saving {filename}: {e}")
+                                    continue
+                                year_hashes[year_dir][checksum] = saved_as = candidate
+
+                            # Record the checksum once here so the audit doesn't have to re-decode it,
+                            # unless an earlier run already recorded this very attachment
+                            previous = year_recorded[year_dir].get((msg_id, filename), ())
+                            if nth < len(previous) and previous[nth] == saved_as:
+                                continue
+                            manifests[year_dir].write(json.dumps({
+                                'msgid': msg_id,
+                                'original': filename,
+                                'filename': saved_as,
+                                'sha256': checksum,
+                            }) + "\n")
+
+            if (i + 1) % 1000 == 0:
+                print(f"  ...scanned {i+1} messages...")
+
+    for manifest in manifests.values():
+        manifest.close()
 
     print("\n--- Extraction Complete ---")
     print(f"Total messages scanned: {total_messages}")
     print(f"Total attachments extracted: {attachments_extracted}")
+    print(f"Duplicate attachments skipped: {duplicates_skipped}")
 
 
 if __name__ == '__main__':
@@ -0,0 +1,80 @@
+import hashlib
+import mmap
+import os
+import sqlite3
+import threading
+
+# --- Configuration ---
+HASH_CACHE_FILE = 'attachment_hashes.db'
+# Files at least this big are hashed straight from an mmap instead of read in chunks
+MMAP_THRESHOLD = 4 * 1024 * 1024
+CHUNK_SIZE = 1 << 20
+
+_lock = threading.Lock()
+_conn = None
+# Copying an initialized hasher is cheaper than constructing a new one per file/payload
+_SHA256_PROTO = hashlib.sha256()
+
+def bytes_digest(data):
+    """Calculates the SHA256 hash of an in-memory payload."""
+    hasher = _SHA256_PROTO.copy()
+    hasher.update(data)
+    return hasher.hexdigest()
+
+def file_digest(file_path):
+    """Calculates the SHA256 hash of a file without loading it all into memory."""
+    hasher = _SHA256_PROTO.copy()
+    with open(file_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size >= MMAP_THRESHOLD:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                hasher.update(mm)
+        else:
+            while chunk := f.read(CHUNK_SIZE):
+                hasher.update(chunk)
+    return hasher.hexdigest()
+
+def _get_conn():
+    """Opens the cache database on first use. Callers must hold _lock."""
+    global _conn
+    if _conn is None:
+        _conn = sqlite3.connect(HASH_CACHE_FILE, check_same_thread=False)
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.execute("PRAGMA synchronous=NORMAL")
+        _conn.execute("""
+            CREATE TABLE IF NOT EXISTS hashes (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                digest TEXT NOT NULL
+            )
+        """)
+        _conn.commit()
+    return _conn
+
+def hashed(file_path):
+    """
+    Returns the SHA256 hash of a file, reusing the cached digest when the file's
+    size and mtime are unchanged since it was last hashed. Safe to call from threads.
+    """
+    path = os.path.abspath(file_path)
+    st = os.stat(path)
+
+    with _lock:
+        row = _get_conn().execute(
+            "SELECT size, mtime_ns, digest FROM hashes WHERE path = ?", (path,)
+        ).fetchone()
+    if row and row[0] == st.st_size and row[1] == st.st_mtime_ns:
+        return row[2]
+
+    # Hash outside the lock so worker threads can overlap I/O
+    digest = file_digest(path)
+    # Commit right away: WAL commits are cheap, and an open write transaction
+    # would block other processes (e.g. audit workers) sharing the cache
+    with _lock:
+        conn = _get_conn()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO hashes (path, size, mtime_ns, digest) VALUES (?, ?, ?, ?)",
+                (path, st.st_size, st.st_mtime_ns, digest)
+            )
+    return digest
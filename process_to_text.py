@@ -1,20 +1,148 @@
-import mailbox
+import hashlib
+import mmap
+import re
+import email.parser
 import email.utils
 import sqlite3
 import os
 import time
 import argparse
+import calendar
+import itertools
+import queue
+import signal
+import threading
+import zlib
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime, timezone
 
 # --- Configuration ---
 SOURCE_MBOX_FILE = 'All mail Including Spam and Trash.mbox'
 DB_FILE = 'email_index.db'
 OUTPUT_DIR = 'yearly_text_archives'
+# Rows are inserted with one executemany and one transaction per batch
+BATCH_SIZE = 5000
+# Messages are parsed on a process pool, PARSE_CHUNK_SIZE messages per task
+PARSE_WORKERS = os.cpu_count() or 1
+PARSE_CHUNK_SIZE = 64
+# Bodies are stored zlib-compressed against a preset dictionary built from the lines
+# most shared by the first BODY_ZDICT_SAMPLES messages (zlib uses at most 32 KiB of it)
+BODY_ZDICT_SAMPLES = 1000
+BODY_ZDICT_SIZE = 32 * 1024
+BODY_ZLIB_LEVEL = 6
+# Prepared statements kept per connection (sqlite3's default is 128)
+STATEMENT_CACHE_SIZE = 256
+# Formatted fetchmany() batches buffered between Phase 2's query loop and its writer thread
+WRITE_QUEUE_SIZE = 8
+
+# Serves the per-thread MAX(date_unix) grouping and the per-thread message fetches in Phase 2
+THREAD_DATE_INDEX_SQL = "CREATE INDEX IF NOT EXISTS idx_emails_thread_date ON emails (thread_id, date_unix DESC)"
+
+# Hot-path statements, kept as constants so every call hits the connection's prepared
+# statement cache with the very same SQL text
+# Rows already in the DB are skipped, except that a header-only stub (NULL body) gets
+# its body filled in
+INSERT_EMAIL_SQL = """
+    INSERT INTO emails (id, message_id, thread_id, date_unix, date_str, from_str, to_str, cc_str, subject_str, gmail_labels, body) 
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (id) DO UPDATE SET body = excluded.body
+    WHERE emails.body IS NULL AND excluded.body IS NOT NULL
+"""
+# Threads belong to the year of their latest message. The grouping streams off
+# idx_emails_thread_date instead of sorting the table.
+YEAR_THREADS_SQL = """
+    INSERT INTO yr_threads (thread_id, sort_key)
+    SELECT thread_id, MAX(date_unix) AS mx FROM emails
+    GROUP BY thread_id HAVING strftime('%Y', mx, 'unixepoch') = ?
+"""
+# Every message of the year's threads, newest thread first, grouped by thread. CROSS JOIN
+# keeps yr_threads as the outer loop, so SQLite walks it in sort_key order and looks up
+# each thread's messages on idx_emails_thread_date instead of scanning all of emails and
+# sorting the result; only each thread's few messages get sorted.
+YEAR_MESSAGES_SQL = """
+    SELECT e.message_id, e.thread_id, e.date_str, e.from_str, e.to_str, e.cc_str, e.subject_str, e.gmail_labels, e.body 
+    FROM yr_threads y CROSS JOIN emails e ON e.thread_id = y.thread_id
+    ORDER BY y.sort_key DESC, y.thread_id, e.date_unix DESC
+"""
+
+FROM_LINE_RE = re.compile(rb'^From ', re.MULTILINE)
+HEADER_END_RE = re.compile(rb'\r?\n\r?\n')
+# The usual RFC 2822 Date form, e.g. "Tue, 3 Sep 2019 14:05:09 -0700 (PDT)"
+DATE_RE = re.compile(r'(?:[A-Z][a-z]{2}, )?(\d{1,2}) ([A-Z][a-z]{2}) (\d{4}) (\d{2}):(\d{2}):(\d{2}) ([+-])(\d{2})(\d{2})(?: \([^()]*\))?')
+MONTHS = {name: i for i, name in enumerate(
+    ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'), 1)}
+DAYS_IN_MONTH = (0, 31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+# Headers read into each emails row, by lowercased name
+INDEXED_HEADERS = {name.lower(): name for name in (
+    'Message-ID', 'References', 'In-Reply-To', 'Date', 'From', 'To', 'Cc', 'Subject', 'X-Gmail-Labels')}
 
 # --- Helper Functions ---
 
+@contextmanager
+def mapped_file(path):
+    """Maps a file read-only for the duration of the block. Empty files map to b''."""
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield b''
+            return
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            yield mm
+        finally:
+            try:
+                mm.close()
+            except BufferError:
+                # Still exported to a live regex iterator (e.g. after Ctrl+C);
+                # the mapping is released once that iterator is collected
+                pass
+
+def iter_mbox_spans(mm):
+    """
+    Yields the (start, end) byte range of each message in a mapped Mbox, found with a
+    single regex pass over "From " separator lines. Like mailbox.mbox, a message starts
+    after its "From " line and excludes the blank line before the next separator.
+    """
+    def span(sep_start, next_sep):
+        start = mm.find(b'\n', sep_start, next_sep) + 1
+        if start == 0:
+            # A final "From " line with no newline after it: an empty message, as in mailbox.mbox
+            return next_sep, next_sep
+        end = next_sep
+        if mm[end - 2:end] == b'\n\n':
+            end -= 1
+        return start, end
+
+    prev_sep = None
+    for match in FROM_LINE_RE.finditer(mm):
+        if prev_sep is not None:
+            yield span(prev_sep, match.start())
+        prev_sep = match.start()
+    if prev_sep is not None:
+        yield span(prev_sep, len(mm))
+
+def parse_headers(mm, start, end):
+    """Parses only the header block of the message at mm[start:end]."""
+    match = HEADER_END_RE.search(mm, start, end)
+    return email.parser.BytesHeaderParser().parsebytes(mm[start:match.start() if match else end])
+
+
+def indexed_headers(msg):
+    """
+    Collects the first value of each INDEXED_HEADERS header in one pass over the parsed
+    header list, instead of one msg.get() scan per header. Non-ASCII values (which may
+    hold undecodable bytes) still go through msg.get(), so the values are the same.
+    """
+    headers = {}
+    for name, value in msg._headers:
+        canonical = INDEXED_HEADERS.get(name.lower())
+        if canonical and canonical not in headers:
+            headers[canonical] = value if value.isascii() else msg.get(canonical)
+    return headers
+
 def get_thread_id(msg):
-    """Finds a stable identifier for a conversation thread."""
+    """Finds a stable identifier for a conversation thread. msg can also be an indexed_headers() dict."""
     references = msg.get('References', '').split()
     if references:
         return references[0]
@@ -23,6 +151,15 @@ def get_thread_id(msg):
         return in_reply_to
     return msg.get('Message-ID')
 
+def message_key(msg_id):
+    """
+    Maps a Message-ID to a stable 63-bit integer used as the emails rowid. An integer
+    primary key is the table's own B-tree, so there's no separate index on the text
+    Message-ID to maintain. A (vanishingly unlikely) collision is skipped like a duplicate.
+    """
+    digest = hashlib.blake2b(msg_id.encode('utf-8', 'surrogatepass'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') & 0x7FFFFFFFFFFFFFFF
+
 def parse_date(date_string):
     """Parses a date string into a timezone-aware datetime object."""
     if not date_string: return None
@@ -35,21 +172,51 @@ def parse_date(date_string):
         except (ValueError, TypeError):
             return None
 
+def parse_date_unix(date_string):
+    """
+    Parses a date string into a unix timestamp. Dates matching DATE_RE are converted with
+    calendar.timegm, without building a datetime; anything else (including out of range
+    fields and "-0000", which parse_date treats as local time) goes through parse_date.
+    """
+    match = DATE_RE.fullmatch(date_string) if isinstance(date_string, str) else None
+    if match:
+        day, mon, year, hh, mm, ss, sign, tz_hh, tz_mm = match.groups()
+        month = MONTHS.get(mon)
+        day, year, hh, mm, ss = int(day), int(year), int(hh), int(mm), int(ss)
+        offset = int(tz_hh) * 3600 + int(tz_mm) * 60
+        if (month and year >= 1000 and 1 <= day <= DAYS_IN_MONTH[month]
+                and (day < 29 or month != 2 or calendar.isleap(year)) and hh < 24 and mm < 60 and ss < 60 and offset < 86400 and (offset or sign == '+')):
+            return calendar.timegm((year, month, day, hh, mm, ss)) - (offset if sign == '+' else -offset)
+
+    dt = parse_date(date_string)
+    return int(dt.timestamp()) if dt else None
+
 def get_email_body(msg):
     """Extracts the text body from an email message."""
     body = ""
     if msg.is_multipart():
-        for part in msg.walk():
-            content_type = part.get_content_type()
-            content_disposition = str(part.get("Content-Disposition"))
-            if content_type == "text/plain" and "attachment" not in content_disposition:
-                try:
-                    charset = part.get_content_charset() or 'utf-8'
-                    payload = part.get_payload(decode=True)
-                    body += payload.decode(charset, 'replace')
-                except (UnicodeDecodeError, AttributeError, LookupError) as e:
-                    print(e)
-                    continue
+        # Depth-first over the MIME tree with an explicit stack, in the same order as
+        # msg.walk(). Only text/plain leaves that aren't attachments are ever decoded;
+        # everything else is rejected on its content type before touching the payload.
+        texts = []
+        stack = [msg]
+        while stack:
+            part = stack.pop()
+            if part.is_multipart():
+                stack.extend(reversed(part.get_payload()))
+                continue
+            if part.get_content_maintype() != 'text' or part.get_content_subtype() != 'plain':
+                continue
+            if part.get_content_disposition() == 'attachment':
+                continue
+            try:
+                charset = part.get_content_charset() or 'utf-8'
+                payload = part.get_payload(decode=True)
+                texts.append(payload.decode(charset, 'replace'))
+            except (UnicodeDecodeError, AttributeError, LookupError) as e:
+                print(e)
+                continue
+        body = "".join(texts)
     else:
         try:
             charset = msg.get_content_charset() or 'utf-8'
@@ -60,40 +227,189 @@ def get_email_body(msg):
             body = ""
     return body.strip()
 
+# Rows are fetched as raw UTF-8 bytes (conn.text_factory = bytes) and dropped into this
+# template as-is, so no per-field str formatting, decoding or re-encoding happens
+MESSAGE_TEMPLATE = (
+    b"--- MESSAGE ---\n"
+    b"Message-ID: %b\n"
+    b"Thread-ID: %b\n"
+    b"Date: %b\n"
+    b"From: %b\n"
+    b"To: %b\n"
+    b"%b" # Optional Cc line
+    b"Subject: %b\n"
+    b"%b" # Optional Labels line
+    b"\n" # Blank line separating headers from body
+    b"%b\n"
+)
+
 def format_message(msg_row):
-    """Formats a database row into a lightweight, parsable text block."""
+    """Formats a database row of bytes fields into a lightweight, parsable text block."""
     msg_id, thread_id, date_str, from_str, to_str, cc_str, subject_str, gmail_labels, body_str = msg_row
     
     # Only show optional lines if they have content
-    cc_line = f"Cc: {cc_str}\n" if cc_str else ""
-    labels_line = f"Labels: {gmail_labels}\n" if gmail_labels else ""
+    cc_line = b"Cc: %b\n" % cc_str if cc_str else b""
+    labels_line = b"Labels: %b\n" % gmail_labels if gmail_labels else b""
+
+    # Archives are LF-only so readers never have to normalize line endings. Folded
+    # headers from a CRLF Mbox keep their CRLFs too, so the whole block is normalized.
+    return (MESSAGE_TEMPLATE % (
+        msg_id, thread_id, date_str, from_str, to_str, cc_line, subject_str, labels_line, body_str
+    )).replace(b'\r\n', b'\n')
+
+def train_body_zdict(bodies):
+    """
+    Builds a zlib preset dictionary from sample bodies: the lines found in more than one
+    body (quoted replies, signatures, footers), most common last as zlib prefers.
+    """
+    counts = Counter()
+    for body in bodies:
+        counts.update(set(body.encode('utf-8').splitlines(keepends=True)))
+    chosen, size = [], 0
+    for line, n in counts.most_common():
+        if n < 2: break
+        if len(line) < 8 or size + len(line) > BODY_ZDICT_SIZE: continue
+        chosen.append(line)
+        size += len(line)
+    return b"".join(reversed(chosen))
+
+def deflate_body(body, compressor):
+    """Compresses a body with a copy of a zdict-primed zlib compressobj."""
+    c = compressor.copy()
+    return c.compress(body.encode('utf-8')) + c.flush()
+
+def inflate_body(blob, decompressor):
+    """Decompresses a stored body back to UTF-8 bytes with a copy of a zdict-primed decompressobj."""
+    d = decompressor.copy()
+    return d.decompress(blob) + d.flush()
+
+def _load_body_zdict(cur):
+    """Returns the DB's body compression dictionary, or None if it has none yet."""
+    cur.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'meta'")
+    if not cur.fetchone(): return None
+    cur.execute("SELECT value FROM meta WHERE key = 'body_zdict'")
+    row = cur.fetchone()
+    return bytes(row[0]) if row else None
+
+def _write_chunks(path, chunks, errors):
+    """
+    Writer thread for Phase 2: writes byte chunks from the queue to path until the None
+    sentinel. On failure the error is kept for the producer and the queue is still
+    drained, so the producer never blocks on a full queue.
+    """
+    try:
+        with open(path, 'wb') as f:
+            while (chunk := chunks.get()) is not None:
+                f.write(chunk)
+    except BaseException as e:
+        errors.append(e)
+        while chunks.get() is not None:
+            pass
 
+def _configure(conn, unsafe_fast=False):
+    """
+    Tunes a connection for bulk work: WAL journal, a 256 MiB page cache, in-memory temp
+    storage and reads served from a mapping of up to 4 GiB of the DB file (SQLite caps
+    this at its compile-time limit, 2 GiB by default) instead of one read() per page.
+    synchronous=NORMAL only syncs at WAL checkpoints;
+    unsafe_fast turns syncing off entirely, which can corrupt the DB on power loss.
+    """
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(f"PRAGMA synchronous={'OFF' if unsafe_fast else 'NORMAL'}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-262144")
+    conn.execute("PRAGMA mmap_size=4294967296")
+
+def parse_message(raw_message, headers_only=False):
+    """
+    Parses one raw message into the emails row tuple, or None if it can't be indexed.
+    headers_only parses just the header block, skipping the MIME tree, and leaves the body None.
+    """
+    if headers_only:
+        message = parse_headers(raw_message, 0, len(raw_message))
+    else:
+        message = email.message_from_bytes(raw_message)
+    headers = indexed_headers(message)
+    msg_id = headers.get('Message-ID')
+    if not msg_id: return None
+
+    date_unix = parse_date_unix(headers.get('Date'))
+    if date_unix is None: return None
+    
+    # ADDED 'Cc' to the extracted data
     return (
-        f"--- MESSAGE ---\n"
-        f"Message-ID: {msg_id}\n"
-        f"Thread-ID: {thread_id}\n"
-        f"Date: {date_str}\n"
-        f"From: {from_str}\n"
-        f"To: {to_str}\n"
-        f"{cc_line}"
-        f"Subject: {subject_str}\n"
-        f"{labels_line}"
-        f"\n" # Blank line separating headers from body
-        f"{body_str}\n"
+        message_key(msg_id), msg_id, get_thread_id(headers), date_unix,
+        str(headers.get('Date')), str(headers.get('From')),
+        str(headers.get('To')), str(headers.get('Cc', '')),
+        str(headers.get('Subject')), str(headers.get('X-Gmail-Labels', '')),
+        None if headers_only else get_email_body(message)
     )
 
+# Per-process mapping of the Mbox and primed body compressor, set up by the pool initializer
+_worker_mbox = None
+_worker_compressor = None
+
+def _init_parse_worker(mbox_path, zdict):
+    """Maps the Mbox once per worker; Ctrl+C is left to the parent, which saves progress."""
+    global _worker_mbox, _worker_compressor
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    with open(mbox_path, 'rb') as f:
+        _worker_mbox = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    _worker_compressor = zlib.compressobj(BODY_ZLIB_LEVEL, zdict=zdict)
+
+def _parse_spans(spans, headers_only):
+    """Pool task: parses a chunk of (start, end) spans of the worker's Mbox mapping."""
+    rows = []
+    for start, end in spans:
+        row = parse_message(_worker_mbox[start:end], headers_only)
+        if row and row[-1] is not None:
+            row = row[:-1] + (deflate_body(row[-1], _worker_compressor),)
+        rows.append(row)
+    return rows
+
+def parse_messages_in_pool(mbox, zdict, headers_only=False):
+    """
+    Parses every message of the mapped SOURCE_MBOX_FILE across a process pool and yields
+    the row tuples, bodies compressed against zdict (or None with headers_only), in Mbox
+    order. Only byte spans are
+    sent to the workers, in chunks to amortize IPC, and the number of chunks in flight
+    is bounded to cap memory use.
+    """
+    spans = iter_mbox_spans(mbox)
+    in_flight = deque()
+    with ProcessPoolExecutor(max_workers=PARSE_WORKERS, initializer=_init_parse_worker,
+                             initargs=(SOURCE_MBOX_FILE, zdict)) as executor:
+        while True:
+            chunk = list(itertools.islice(spans, PARSE_CHUNK_SIZE))
+            if chunk:
+                in_flight.append(executor.submit(_parse_spans, chunk, headers_only))
+            if not in_flight:
+                break
+            if chunk and len(in_flight) < PARSE_WORKERS * 4:
+                continue
+            for email_data in in_flight.popleft().result():
+                if email_data: yield email_data
+
 # --- Main Script Phases ---
 
-def phase_one_ingest():
-    """Phase 1: Read Mbox and incrementally ingest emails into the SQLite DB."""
+def phase_one_ingest(unsafe_fast=False, headers_only=False):
+    """
+    Phase 1: Read Mbox and incrementally ingest emails into the SQLite DB. headers_only
+    quickly indexes NULL-body stubs; a later full ingest fills in their bodies.
+    """
     print("--- Phase 1: Ingesting emails into database ---")
-    conn = sqlite3.connect(DB_FILE)
+    conn = sqlite3.connect(DB_FILE, cached_statements=STATEMENT_CACHE_SIZE)
+    # Autocommit mode: the module issues no implicit BEGIN/COMMIT, each batch below
+    # is one explicit transaction
+    conn.isolation_level = None
+    _configure(conn, unsafe_fast)
     cur = conn.cursor()
     
     # ADDED 'cc_str' column to the table schema
     cur.execute("""
         CREATE TABLE IF NOT EXISTS emails (
-            message_id TEXT PRIMARY KEY,
+            id INTEGER PRIMARY KEY,
+            message_id TEXT NOT NULL,
             thread_id TEXT NOT NULL,
             date_unix INTEGER NOT NULL,
             date_str TEXT,
@@ -102,63 +418,88 @@ def phase_one_ingest():
             cc_str TEXT,
             subject_str TEXT,
             gmail_labels TEXT,
-            body TEXT
+            body BLOB
         )
     """)
-    conn.commit()
+    cur.execute(THREAD_DATE_INDEX_SQL)
+    cur.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value BLOB)")
+
+    # Databases ingested by older versions are keyed on the text message_id, or hold
+    # uncompressed bodies
+    zdict = _load_body_zdict(cur)
+    if ('id' not in [row[1] for row in cur.execute("PRAGMA table_info(emails)")]
+            or (zdict is None and cur.execute("SELECT 1 FROM emails LIMIT 1").fetchone())):
+        print(f"Error: '{DB_FILE}' uses an older schema. Delete it and re-run --ingest.")
+        conn.close()
+        return
 
     processed_count = 0
     skipped_count = 0
+    batch = []
     start_time = time.time()
+
+    def count_stubs():
+        """
+        Counts header-only rows. rowcount can't tell inserts from filled-in stubs, so
+        the stubs are counted before and after a full pass instead (one scan each).
+        """
+        return cur.execute("SELECT COUNT(*) FROM emails WHERE body IS NULL").fetchone()[0]
+
+    stubs_before = 0 if headers_only else count_stubs()
+    saved_label = "new or filled-in" if stubs_before else "new"
+
+    def flush_batch():
+        """Writes the pending rows in one transaction. Rows already in the DB are skipped, stubs filled."""
+        nonlocal processed_count, skipped_count
+        if not batch: return
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            cur.executemany(INSERT_EMAIL_SQL, batch)
+            # One rowid probe per row; rowcount tells how many were new or filled in
+            inserted = cur.rowcount
+            cur.execute("COMMIT")
+        except BaseException:
+            cur.execute("ROLLBACK")
+            raise
+        processed_count += inserted
+        skipped_count += len(batch) - inserted
+        batch.clear()
     
     try:
         print("-> Opening Mbox file...", flush=True)
-        mbox = mailbox.mbox(SOURCE_MBOX_FILE)
-        print("-> Starting email processing. Press Ctrl+C to stop and save progress.", flush=True)
+        with mapped_file(SOURCE_MBOX_FILE) as mbox:
+            if zdict is None:
+                print("-> Building body compression dictionary...", flush=True)
+                samples = (parse_message(mbox[start:end])
+                           for start, end in itertools.islice(iter_mbox_spans(mbox), BODY_ZDICT_SAMPLES))
+                zdict = train_body_zdict(row[-1] for row in samples if row)
+                cur.execute("INSERT INTO meta (key, value) VALUES ('body_zdict', ?)", (zdict,))
 
-        for i, message in enumerate(mbox):
-            msg_id = message.get('Message-ID')
-            if not msg_id: continue
+            print("-> Starting email processing. Press Ctrl+C to stop and save progress.", flush=True)
 
-            cur.execute("SELECT 1 FROM emails WHERE message_id = ?", (msg_id,))
-            if cur.fetchone():
-                skipped_count += 1
-                continue
+            for email_data in parse_messages_in_pool(mbox, zdict, headers_only):
+                batch.append(email_data)
 
-            dt = parse_date(message.get('Date'))
-            if not dt: continue
-            
-            # ADDED 'Cc' to the extracted data
-            email_data = (
-                msg_id, get_thread_id(message), int(dt.timestamp()),
-                str(message.get('Date')), str(message.get('From')),
-                str(message.get('To')), str(message.get('Cc', '')),
-                str(message.get('Subject')), str(message.get('X-Gmail-Labels', '')),
-                get_email_body(message)
-            )
-            
-            # UPDATED INSERT statement for the new column
-            cur.execute("""
-                INSERT INTO emails (message_id, thread_id, date_unix, date_str, from_str, to_str, cc_str, subject_str, gmail_labels, body) 
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, email_data)
-            
-            processed_count += 1
-
-            if (processed_count > 0) and (processed_count % 250 == 0):
-                conn.commit()
-                print(f"  ...processed {processed_count} new emails | Saved to DB", flush=True)
+                if len(batch) >= BATCH_SIZE:
+                    flush_batch()
+                    print(f"  ...processed {processed_count} {saved_label} emails | Saved to DB", flush=True)
 
     except KeyboardInterrupt:
         print("\n-> KeyboardInterrupt detected. Saving progress...")
     finally:
         print("-> Committing final transaction...")
-        conn.commit()
+        flush_batch()
+        filled_count = stubs_before - count_stubs() if stubs_before else 0
         conn.close()
         duration = time.time() - start_time
         print("\n--- Ingestion Paused/Finished ---")
-        print(f"Processed {processed_count} new emails in this session.")
+        print(f"Processed {processed_count - filled_count} new emails in this session.")
+        if filled_count:
+            print(f"Filled in the bodies of {filled_count} header-only emails.")
+        print(f"Skipped {skipped_count} emails already in the database.")
         print(f"Total duration: {duration:.2f} seconds.")
+        if headers_only:
+            print("Bodies were skipped. Run --ingest again without --headers-only to fill them in.")
 
 def phase_two_write():
     """Phase 2: Query the DB, sort, and write the final text files."""
@@ -167,47 +508,74 @@ def phase_two_write():
         print(f"Error: Database file '{DB_FILE}' not found. Run --ingest first.")
         return
 
-    conn = sqlite3.connect(DB_FILE)
+    conn = sqlite3.connect(DB_FILE, cached_statements=STATEMENT_CACHE_SIZE)
+    _configure(conn)
     cur = conn.cursor()
 
-    print("  -> Determining conversation sort order...")
-    cur.execute("SELECT thread_id, MAX(date_unix) FROM emails GROUP BY thread_id")
-    thread_sort_keys = {thread_id: max_date for thread_id, max_date in cur.fetchall()}
+    # Rows per fetchmany() batch of the message stream
+    cur.arraysize = 4096
+
+    # Databases ingested by older versions may not have the index yet
+    cur.execute(THREAD_DATE_INDEX_SQL)
+    conn.commit()
+    zdict = _load_body_zdict(cur)
+    if zdict is None:
+        print(f"Error: '{DB_FILE}' uses an older schema. Delete it and re-run --ingest.")
+        conn.close()
+        return
+    decompressor = zlib.decompressobj(zdict=zdict)
+    cur.execute("CREATE TEMP TABLE yr_threads (thread_id TEXT PRIMARY KEY, sort_key INTEGER)")
+    # Lets the join below walk a year's threads already in output order
+    cur.execute("CREATE INDEX temp.idx_yr_threads_sort ON yr_threads (sort_key DESC, thread_id)")
     
-    cur.execute("SELECT DISTINCT strftime('%Y', date_unix, 'unixepoch') FROM emails")
-    years = [row[0] for row in cur.fetchall()]
-    print(f"  -> Found data for years: {', '.join(sorted(years))}")
+    # Years come back sorted; the cursor is reused below, so keep the (short) list
+    cur.execute("SELECT DISTINCT strftime('%Y', date_unix, 'unixepoch') FROM emails ORDER BY 1")
+    years = [row[0] for row in cur]
+    print(f"  -> Found data for years: {', '.join(years)}")
 
     if not os.path.exists(OUTPUT_DIR):
         os.makedirs(OUTPUT_DIR)
 
-    for year in sorted(years):
+    # Message rows are written out verbatim, see MESSAGE_TEMPLATE
+    conn.text_factory = bytes
+
+    for year in years:
         print(f"  -> Processing {year}...")
         output_file_path = os.path.join(OUTPUT_DIR, f"{year}.txt")
         
-        items_for_year = []
-        for thread_id, sort_key in thread_sort_keys.items():
-            if datetime.fromtimestamp(sort_key, timezone.utc).year == int(year):
-                items_for_year.append((sort_key, thread_id))
-
-        items_for_year.sort(key=lambda x: x[0], reverse=True)
+        cur.execute("DELETE FROM yr_threads")
+        cur.execute(YEAR_THREADS_SQL, (year,))
+        # One query streams every message of the year, already grouped by thread
+        cur.execute(YEAR_MESSAGES_SQL)
         
-        with open(output_file_path, 'w', encoding='utf-8') as f:
-            for _, thread_id in items_for_year:
-                # UPDATED SELECT query to fetch 'cc_str'
-                cur.execute("""
-                    SELECT message_id, thread_id, date_str, from_str, to_str, cc_str, subject_str, gmail_labels, body 
-                    FROM emails WHERE thread_id = ? ORDER BY date_unix DESC
-                """, (thread_id,))
-                
-                messages_in_thread = cur.fetchall()
-
-                for i, msg_row in enumerate(messages_in_thread):
-                    f.write(format_message(msg_row))
-                    if i < len(messages_in_thread) - 1:
-                        f.write("\n")
-                
-                f.write("\n\n")
+        # Each fetched batch is formatted into one chunk and handed to a writer thread, so
+        # disk writes overlap with SQLite reads (both run without the GIL)
+        chunks = queue.Queue(maxsize=WRITE_QUEUE_SIZE)
+        errors = []
+        writer = threading.Thread(target=_write_chunks, args=(output_file_path, chunks, errors))
+        writer.start()
+        try:
+            current_thread = None
+            while rows := cur.fetchmany():
+                pieces = []
+                for msg_row in rows:
+                    if msg_row[1] == current_thread:
+                        pieces.append(b"\n")
+                    else:
+                        if current_thread is not None:
+                            pieces.append(b"\n\n")
+                        current_thread = msg_row[1]
+                    # Header-only stubs have no body yet
+                    body = inflate_body(msg_row[8], decompressor) if msg_row[8] is not None else b""
+                    pieces.append(format_message(msg_row[:8] + (body,)))
+                chunks.put(b"".join(pieces))
+            if current_thread is not None:
+                chunks.put(b"\n\n")
+        finally:
+            chunks.put(None)
+            writer.join()
+        if errors:
+            raise errors[0]
         
         print(f"     -> Successfully wrote '{output_file_path}'")
 
@@ -219,6 +587,8 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Process a Google Takeout Mbox file into sorted, yearly text files.")
     parser.add_argument('--ingest', action='store_true', help="Run Phase 1: Ingest emails from Mbox into the SQLite database.")
     parser.add_argument('--write', action='store_true', help="Run Phase 2: Write sorted text files from the database.")
+    parser.add_argument('--headers-only', action='store_true', help="With --ingest: index headers only (much faster), leaving bodies empty. A later plain --ingest fills them in. On a new database the first %d messages are still parsed in full, to build the body compression dictionary." % BODY_ZDICT_SAMPLES)
+    parser.add_argument('--unsafe-fast', action='store_true', help="Ingest with synchronous=OFF. Faster, but a power loss or OS crash can corrupt the database.")
     
     args = parser.parse_args()
 
@@ -226,7 +596,7 @@ if __name__ == "__main__":
         parser.print_help()
     
     if args.ingest:
-        phase_one_ingest()
+        phase_one_ingest(unsafe_fast=args.unsafe_fast, headers_only=args.headers_only)
     
     if args.write:
         phase_two_write()
@@ -0,0 +1,67 @@
+import os
+
+import pytest
+
+import audit_random_sample
+import process_to_text
+from export_attachments_by_year import extract_attachments
+
+MBOX = (
+    b"From a@x Mon Jun 10 10:00:00 2019\n"
+    b"Message-ID: <plain@x>\n"
+    b"Date: Mon, 10 Jun 2019 10:00:00 +0000\n"
+    b"From: a@x\n"
+    b"To: b@x\n"
+    b"Subject: plain\n"
+    b"\n"
+    b"just text\n"
+    b"\n"
+    b"From a@x Tue Jun 11 10:00:00 2019\n"
+    b"Message-ID: <attached@x>\n"
+    b"Date: Tue, 11 Jun 2019 10:00:00 +0000\n"
+    b"From: a@x\n"
+    b"To: b@x\n"
+    b"Subject: with attachment\n"
+    b"MIME-Version: 1.0\n"
+    b"Content-Type: multipart/mixed; boundary=BOUNDARY\n"
+    b"\n"
+    b"--BOUNDARY\n"
+    b"Content-Type: text/plain\n"
+    b"\n"
+    b"see attached\n"
+    b"--BOUNDARY\n"
+    b"Content-Type: application/octet-stream\n"
+    b"Content-Disposition: attachment; filename=\"notes.bin\"\n"
+    b"Content-Transfer-Encoding: base64\n"
+    b"\n"
+    b"aGVsbG8gd29ybGQ=\n"
+    b"--BOUNDARY--\n"
+)
+
+
+@pytest.fixture
+def archive(tmp_path, monkeypatch):
+    """Ingests, writes and extracts a two-message Mbox in a scratch directory."""
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / process_to_text.SOURCE_MBOX_FILE).write_bytes(MBOX)
+    process_to_text.phase_one_ingest()
+    process_to_text.phase_two_write()
+    extract_attachments(process_to_text.SOURCE_MBOX_FILE)
+    monkeypatch.setattr(audit_random_sample, 'SAMPLE_PERCENTAGE', 1.0)
+    return tmp_path
+
+
+def test_audit_passes_on_fresh_archive(archive, capsys):
+    audit_random_sample.main()
+    out = capsys.readouterr().out
+    assert "Result on 2 message sample: 2 PASSED, 0 FAILED." in out
+    assert "Archive integrity confirmed" in out
+
+
+def test_audit_reports_tampered_attachment(archive, capsys):
+    with open(os.path.join('attachments_by_year', '2019', 'notes.bin'), 'wb') as f:
+        f.write(b"something else")
+    audit_random_sample.main()
+    out = capsys.readouterr().out
+    assert "Result on 2 message sample: 1 PASSED, 1 FAILED." in out
+    assert "Checksum mismatch for attachment: notes.bin" in out
@@ -0,0 +1,27 @@
+import mailbox
+
+from process_to_text import iter_mbox_spans
+
+
+def mailbox_messages(tmp_path, data):
+    """The raw bytes of each message as mailbox.mbox reads them from the same data."""
+    path = tmp_path / 'fixture.mbox'
+    path.write_bytes(data)
+    box = mailbox.mbox(str(path))
+    return [box.get_bytes(key) for key in box.keys()]
+
+
+def test_spans_match_mailbox(tmp_path):
+    data = (b'From a Mon\nMessage-ID: <1@x>\n\nbody\n\n'
+            b'From b Tue\nMessage-ID: <2@x>\n\nsecond\n')
+    spans = list(iter_mbox_spans(data))
+    assert spans == [(11, 35), (47, 73)]
+    assert [data[start:end] for start, end in spans] == mailbox_messages(tmp_path, data)
+
+
+def test_final_from_line_without_newline_is_an_empty_message(tmp_path):
+    data = b'From a Mon\nMessage-ID: <1@x>\n\nbody\n\nFrom b Tue'
+    spans = list(iter_mbox_spans(data))
+    # Never (0, len(data)): the trailing separator is an empty message, like mailbox.mbox
+    assert spans == [(11, 35), (46, 46)]
+    assert [data[start:end] for start, end in spans] == mailbox_messages(tmp_path, data)